@@ -1,4 +1,5 @@
 import streamlit as st
+import numba
 import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
@@ -7,134 +8,195 @@ from plotly.subplots import make_subplots
 # --- 페이지 기본 설정 ---
 st.set_page_config(layout="wide", page_title="통합 전력 최적화 시뮬레이터")
 
+# 에이전트 행동 코드 -> 라벨 (Numba 코어는 int8 코드만 다룸)
+ACTION_LABELS = np.array(["일반 모드", "비용 절감 모드 (부하 지연)", "고성능 모드 (지연 부하 처리)"])
+
 
 # --- 시뮬레이션 함수 ---
-def run_integrated_simulation(params):
+@numba.njit(cache=True)
+def _resolve_bank_and_ess(sim_hours, base_it_load, deferrable_load_schedule,
+                          cost_save_mask, buy_mask, sell_mask, pue_arr,
+                          max_process_power, ess_capacity_kwh, max_power_kw):
     """
-    데이터센터와 전력 거래를 통합한 시뮬레이션 실행
+    순차 의존성이 남는 두 상태(유연 부하 은행, ESS SoC)만 해소하는 코어.
+    가격 마스크/PUE 등 벡터화 가능한 계산은 호출 측의 NumPy가 담당하고,
+    여기서는 두 개의 짧은 스칼라 루프만 Numba가 기계어로 컴파일함
     """
-    sim_hours = params['sim_hours']
-
-    # 1. 환경 생성: 전력 가격(SMP) 및 IT 워크로드 프로파일 생성
-    time = np.arange(sim_hours)
-    # SMP: 하루 주기성을 가진 가격 곡선
-    smp = 100 - np.cos(time * np.pi / 12) * 50 + np.random.randn(sim_hours) * 5
-    smp = np.maximum(smp, 20)
+    it_load_processed = np.empty(sim_hours)
+    actions = np.empty(sim_hours, dtype=np.int8)
 
-    # IT 워크로드: 기본 부하 + 특정 시간에 몰리는 유연 부하(Deferrable Load)
-    base_it_load = np.full(sim_hours, params['base_it_load_kw']) + np.sin(time * np.pi / 12) * 10
-    deferrable_load_schedule = np.zeros(sim_hours)
-    # 오후(13~16시)에 유연 부하 집중 발생
-    deferrable_load_schedule[13:17] = params['deferrable_load_kw']
-    deferrable_load_schedule[13 + 24:17 + 24] = params['deferrable_load_kw']  # 이틀치 시뮬레이션
-
-    # 2. 시뮬레이션 변수 초기화
-    # DC 관련
-    dc_total_load_log, pue_log, it_load_processed_log = [], [], []
-    deferred_bank = 0  # 미뤄진 작업 저장소 (단위: kWh)
-
-    # 거래 관련
-    soc_log = [params['ess_capacity_kwh'] / 2]
-    grid_power_log = []
-    total_cost_log = [0]
-
-    # 로그용
-    actions_log = []
-
-    # 3. 시간대별 시뮬레이션 루프
+    # 루프 1: 유연 부하 은행 해소
+    deferred_bank = 0.0  # 미뤄진 작업 저장소 (단위: kWh)
     for t in range(sim_hours):
-        current_smp = smp[t]
-        current_soc = soc_log[-1]
-
-        # --- 입력(State) 기반 행동(Action) 결정 ---
-        action = "일반 모드"
-        pue = params['pue_normal']
-
         # 유연 부하를 은행에 추가
         deferred_bank += deferrable_load_schedule[t]
 
-        # 정책 1: 가격이 너무 비싸면 비용 절감 모드 돌입
-        if current_smp > params['cost_saving_threshold']:
-            action = "비용 절감 모드 (부하 지연)"
-            pue = params['pue_eco']
-            processed_it_load = base_it_load[t]  # 기본 부하만 처리
-
-        # 정책 2: 가격이 싸고, 처리할 작업이 남아있으면 고성능 모드
-        elif current_smp < params['buy_threshold'] and deferred_bank > 0:
-            action = "고성능 모드 (지연 부하 처리)"
-            pue = params['pue_normal']
-            # 은행에 쌓인 작업 처리 (처리 능력 한도 내에서)
-            processable_load = params['max_process_power'] - base_it_load[t]
-            processed_from_bank = min(deferred_bank, processable_load)
-            processed_it_load = base_it_load[t] + processed_from_bank
-            deferred_bank -= processed_from_bank
-
-        # 정책 3: 일반적인 상황
+        # 정책 1: 가격이 너무 비싸면 비용 절감 모드 돌입 (기본 부하만 처리)
+        if cost_save_mask[t]:
+            actions[t] = 1
+            it_load_processed[t] = base_it_load[t]
+        # 정책 2/3: 남는 처리 능력 한도 내에서 은행에 쌓인 작업 처리
         else:
-            processed_it_load = base_it_load[t]
-            # 남는 처리 능력이 있다면 은행 작업도 처리
-            processable_load = params['max_process_power'] - base_it_load[t]
-            processed_from_bank = min(deferred_bank, processable_load)
-            processed_it_load += processed_from_bank
-            deferred_bank -= processed_from_bank
-
-        # DC 총 전력 소비량 계산
-        cooling_load = processed_it_load * (pue - 1)
-        current_dc_total_load = processed_it_load + cooling_load
-
-        # --- 전력 공급원 결정 (ESS vs Grid) ---
-        power_needed = current_dc_total_load
+            if buy_mask[t] and deferred_bank > 0:
+                actions[t] = 2  # 고성능 모드
+            else:
+                actions[t] = 0  # 일반 모드
+            processable_load = max_process_power - base_it_load[t]
+            drawn = min(deferred_bank, processable_load)
+            it_load_processed[t] = base_it_load[t] + drawn
+            deferred_bank -= drawn
+
+    # DC 총 전력 소비량: IT 부하 + 냉각(IT*(PUE-1)) == IT*PUE
+    dc_total_load = it_load_processed * pue_arr
+
+    # 루프 2: ESS SoC 해소 (전력 공급원 결정: ESS vs Grid)
+    grid_power = np.empty(sim_hours)
+    soc_arr = np.empty(sim_hours + 1)
+    soc_arr[0] = ess_capacity_kwh / 2
+    for t in range(sim_hours):
+        current_soc = soc_arr[t]
+        power_needed = dc_total_load[t]
 
         # ESS 방전 결정 (DC에 전력 공급 or 판매)
-        if current_smp > params['sell_threshold'] and current_soc > 0:
-            power_from_ess = min(current_soc, params['max_power_kw'])
+        if sell_mask[t] and current_soc > 0:
+            power_from_ess = min(current_soc, max_power_kw)
             soc_change = -power_from_ess
             power_from_grid = power_needed - power_from_ess  # < 0 이면 판매
         # ESS 충전 결정
-        elif current_smp < params['buy_threshold'] and current_soc < params['ess_capacity_kwh']:
-            charge_amount = min(params['max_power_kw'], params['ess_capacity_kwh'] - current_soc)
+        elif buy_mask[t] and current_soc < ess_capacity_kwh:
+            charge_amount = min(max_power_kw, ess_capacity_kwh - current_soc)
             soc_change = charge_amount
             power_from_grid = power_needed + charge_amount
         # ESS로 DC 부하 우선 감당
         else:
-            power_from_ess = min(current_soc, power_needed, params['max_power_kw'])
+            power_from_ess = min(current_soc, power_needed, max_power_kw)
             soc_change = -power_from_ess
             power_from_grid = power_needed - power_from_ess
 
-        # 변수 업데이트 및 로그 기록
-        soc_log.append(current_soc + soc_change)
-        total_cost_log.append(
-            total_cost_log[-1] + max(0, power_from_grid) * current_smp - max(0, -power_from_grid) * current_smp)
+        soc_arr[t + 1] = current_soc + soc_change
+        grid_power[t] = power_from_grid
+
+    return (dc_total_load, it_load_processed, grid_power,
+            soc_arr, actions, deferred_bank)
+
 
-        dc_total_load_log.append(current_dc_total_load)
-        pue_log.append(pue)
-        it_load_processed_log.append(processed_it_load)
-        grid_power_log.append(power_from_grid)
-        actions_log.append(action)
+@st.cache_data(show_spinner=False)
+def run_integrated_simulation(sim_hours, base_it_load_kw, deferrable_load_kw,
+                              max_process_power, pue_normal, pue_eco,
+                              ess_capacity_kwh, max_power_kw, buy_threshold,
+                              sell_threshold, cost_saving_threshold, seed=0):
+    """
+    데이터센터와 전력 거래를 통합한 시뮬레이션 실행.
+    파라미터가 같으면 결과가 결정적이므로 Streamlit 재실행 간에 캐싱됨
+    """
+    # 1. 환경 생성: 전력 가격(SMP) 및 IT 워크로드 프로파일 생성
+    time = np.arange(sim_hours)
+    time_phase = time * (np.pi / 12)  # 하루 주기 위상 (SMP와 IT 부하가 공유)
+    # SMP: 하루 주기성을 가진 가격 곡선 (시드 고정으로 재현 가능)
+    rng = np.random.default_rng(seed)
+    smp = 100 - np.cos(time_phase) * 50 + rng.standard_normal(sim_hours, dtype=np.float32) * 5
+    smp = np.maximum(smp, 20)
 
-    # 결과 데이터프레임 생성
-    results_df = pd.DataFrame({
-        '시간': time, '전력가격 (SMP)': smp, 'DC 총 소비전력 (kW)': dc_total_load_log,
-        '처리된 IT 부하 (kW)': it_load_processed_log, '그리드 전력 (kW)': grid_power_log,
-        'ESS 충전량 (kWh)': soc_log[:-1], '적용된 PUE': pue_log, '누적 비용 (원)': total_cost_log[:-1],
-        '에이전트 행동': actions_log
-    })
-    return results_df, deferred_bank
+    # IT 워크로드: 기본 부하 + 특정 시간에 몰리는 유연 부하(Deferrable Load)
+    # (out= 지정으로 중간 배열 할당 없이 한 버퍼 위에서 계산)
+    base_it_load = np.empty(sim_hours, dtype=np.float32)
+    np.sin(time_phase, out=base_it_load)
+    base_it_load *= 10
+    base_it_load += base_it_load_kw
+    # 오후(13~16시)에 유연 부하 집중 발생: 하루 프로파일을 만들어 기간만큼 타일링
+    day_profile = np.zeros(24)
+    day_profile[13:17] = deferrable_load_kw
+    deferrable_load_schedule = np.tile(day_profile, sim_hours // 24 + 1)[:sim_hours]
+
+    # 2. 가격 기반 정책 결정: 분기 대신 벡터 마스크/블렌드로 사전 계산
+    cost_save_mask = smp > cost_saving_threshold
+    buy_mask = smp < buy_threshold
+    sell_mask = smp > sell_threshold
+    pue_arr = np.where(cost_save_mask, pue_eco, pue_normal)
+
+    # 3. 컴파일된 코어로 순차 상태(은행/SoC) 해소
+    (dc_total_load, it_load_processed, grid_power,
+     soc_arr, actions, deferred_bank) = _resolve_bank_and_ess(
+        sim_hours, base_it_load, deferrable_load_schedule,
+        cost_save_mask, buy_mask, sell_mask, pue_arr,
+        max_process_power, ess_capacity_kwh, max_power_kw)
+
+    # 4. 비용 누적: max(0,g)*p - max(0,-g)*p == g*p 이므로 단일 누적합으로 계산
+    step_cost = grid_power * smp
+    total_cost = np.empty(sim_hours + 1)
+    total_cost[0] = 0
+    np.cumsum(step_cost, out=total_cost[1:])
+
+    # 결과 데이터프레임 생성: 모든 열이 이미 타입이 정해진 배열이므로
+    # dtype 추론/복사 없이 열 단위로 그대로 조립
+    # (행동 라벨은 상세 로그를 열 때만 필요하므로 int8 코드로 따로 반환)
+    results_df = pd.DataFrame.from_dict({
+        '시간': time.astype(np.int16),
+        '전력가격 (SMP)': smp.astype(np.float32),
+        'DC 총 소비전력 (kW)': dc_total_load.astype(np.float32),
+        '처리된 IT 부하 (kW)': it_load_processed.astype(np.float32),
+        '그리드 전력 (kW)': grid_power.astype(np.float32),
+        'ESS 충전량 (kWh)': soc_arr[:-1].astype(np.float32),
+        '적용된 PUE': pue_arr.astype(np.float32),
+        '누적 비용 (원)': total_cost[:-1].astype(np.float32)
+    }, orient='columns')
+    return results_df, deferred_bank, actions
 
 
 # 1. 인센티브 분석 함수
+@st.cache_data(show_spinner=False)
 def analyze_incentive_vs_cost(results, participation_ratio=0.6, incentive_rate=1.2):
+    # pandas 인덱싱 대신 NumPy 배열 위에서 마스크 한 번으로 계산
+    smp = results['전력가격 (SMP)'].to_numpy()
+    dc_load = results['DC 총 소비전력 (kW)'].to_numpy()
     cost = results['누적 비용 (원)'].iloc[-1]
-    high_price_threshold = results['전력가격 (SMP)'].quantile(0.8)
-    strategic_hours = results[results['전력가격 (SMP)'] > high_price_threshold]
-    potential_reduction = (strategic_hours['DC 총 소비전력 (kW)'].mean() * participation_ratio) * len(strategic_hours)
-    average_high_price = strategic_hours['전력가격 (SMP)'].mean()
+
+    # 상위 20% 기준값: 전체 정렬 대신 O(n) 부분 선택으로 계산
+    k = int(len(smp) * 0.8)
+    high_price_threshold = np.partition(smp, k)[k]
+    high_mask = smp > high_price_threshold
+    potential_reduction = dc_load[high_mask].mean() * participation_ratio * high_mask.sum()
+    average_high_price = smp[high_mask].mean()
     incentive = potential_reduction * average_high_price * incentive_rate
     return cost, incentive, potential_reduction
 
 
 import plotly.graph_objects as go
 
+# 2. 결과 차트 생성 함수 (파라미터가 같으면 Figure 객체를 재사용)
+@st.cache_resource(show_spinner=False)
+def plot_load_vs_price_plotly(results):
+    fig = make_subplots(specs=[[{"secondary_y": True}]])
+    fig.add_trace(go.Scatter(x=results['시간'], y=results['전력가격 (SMP)'], name="전력가격(SMP)", line=dict(color='orange')),
+                  secondary_y=False)
+    fig.add_trace(go.Scatter(x=results['시간'], y=results['DC 총 소비전력 (kW)'], name="DC 총 소비전력", line=dict(color='blue')),
+                  secondary_y=True)
+    fig.update_layout(title_text="DC 소비전력은 전력 가격에 '반응'하여 변동합니다",
+                      legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1))
+    fig.update_yaxes(title_text="<b>가격(원/kWh)</b>", secondary_y=False)
+    fig.update_yaxes(title_text="<b>전력(kW)</b>", secondary_y=True)
+    return fig
+
+
+@st.cache_resource(show_spinner=False)
+def plot_energy_flow_plotly(results, max_power_kw, max_process_power):
+    fig = make_subplots(specs=[[{"secondary_y": True}]])
+    fig.add_trace(go.Bar(x=results['시간'], y=results['그리드 전력 (kW)'], name="그리드 전력 (구매/판매)", marker_color='lightgreen'),
+                  secondary_y=False)
+    fig.add_trace(
+        go.Scatter(x=results['시간'], y=results['ESS 충전량 (kWh)'], name="ESS 충전량(SoC)", line=dict(color='purple')),
+        secondary_y=False)
+    fig.add_trace(go.Scatter(x=results['시간'], y=results['누적 비용 (원)'], name="누적 비용", line=dict(color='red', width=3)),
+                  secondary_y=True)
+    fig.update_layout(title_text="ESS 운영 및 그리드 상호작용을 통한 비용 최적화",
+                      legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1))
+    fig.update_yaxes(title_text="<b>전력(kW/kWh)</b>", secondary_y=False,
+                     range=[-max_power_kw * 1.5, max_process_power * 2])
+    fig.update_yaxes(title_text="<b>누적 비용(원)</b>", secondary_y=True)
+    return fig
+
+
+@st.cache_resource(show_spinner=False)
 def plot_incentive_vs_cost_plotly(cost, incentive):
     fig = go.Figure()
 
@@ -158,25 +220,29 @@ def plot_incentive_vs_cost_plotly(cost, incentive):
 
 
 
-# --- Streamlit UI 구성 ---
-st.title("⚡️ DC-XAI 데이터센터 통합 최적화 시뮬레이터")
-st.markdown("""
+# --- 정적 안내 문구 (재실행 시 재생성되지 않도록 모듈 상수로 유지) ---
+_INTRO_MD = """
 본 시뮬레이터는 **데이터센터 전력 최적화**와 **전력 거래 최적화**를 동시에 수행하는 강화학습 에이전트가 작동하는 방식을 보여줍니다.  
 에이전트는 `전력 가격(SMP)`에 따라 `IT 작업 스케줄링`, `냉각 정책`,`ESS 충/방전`을 통합적으로 결정하여 총 운영 비용을 최소화합니다.  
-""")
+"""
 
-
-st.markdown("## ✅ Benefits")
-st.markdown("""
+_BENEFITS_MD = """
  💰  **운영 비용 절감**: 전력 가격 변화에 따른 실시간 부하 조절이 가능합니다.  
  🌱  **탄소 배출 저감**: 냉각 정책과 ESS 운용 최적화를 통한 친환경 전략을 세울 수 있습니다.  
  🤖  **AI 기반 의사결정**: 강화학습 정책으로 상황에 따른 최적 행동을 선택하는 AI 모델입니다.  
  📊  **가시성 확보**: ESS, PUE, 전력 가격 등 다양한 지표를 시각적으로 추적할 수 있습니다.  
  🛠️  **시나리오 실험**: 다양한 매개변수를 통해 맞춤형 전략 테스트가 가능합니다.  
-""")
+"""
+
+# --- Streamlit UI 구성 ---
+st.title("⚡️ DC-XAI 데이터센터 통합 최적화 시뮬레이터")
+st.markdown(_INTRO_MD)
+
+st.markdown("## ✅ Benefits")
+st.markdown(_BENEFITS_MD)
 
 # --- 사이드바: 사용자 입력 파라미터 ---
-with st.sidebar:
+with st.sidebar.form("sim_params"):
     st.header("⚙️ 시뮬레이션 설정")
     params = {}
     params['sim_hours'] = 48
@@ -199,9 +265,12 @@ with st.sidebar:
         params['sell_threshold'] = st.slider("매도 기준 가격", 100.0, 200.0, 140.0, 1.0)
         params['cost_saving_threshold'] = st.slider("비용 절감(부하 지연) 기준 가격", 100.0, 200.0, 130.0, 1.0)
 
+    # 폼 제출 전까지는 슬라이더를 움직여도 재실행되지 않음
+    st.form_submit_button("적용", type="primary")
+
 # --- 메인 화면 ---
 if st.button("🚀 통합 최적화 시뮬레이션 실행", type="primary"):
-    results, remaining_deferred_load = run_integrated_simulation(params)
+    results, remaining_deferred_load, action_codes = run_integrated_simulation(**params)
 
     st.header("📊 시뮬레이션 결과")
     col1, col2, col3 = st.columns(3)
@@ -212,35 +281,17 @@ if st.button("🚀 통합 최적화 시뮬레이션 실행", type="primary"):
     col3.metric("남은 유연 부하 (kWh)", f"{remaining_deferred_load:.1f}", help="시뮬레이션 종료 후 처리되지 못한 작업량")
 
     st.subheader("📈 DC 소비전력 vs. 전력 가격(SMP)")
-    fig1 = make_subplots(specs=[[{"secondary_y": True}]])
-    fig1.add_trace(go.Scatter(x=results['시간'], y=results['전력가격 (SMP)'], name="전력가격(SMP)", line=dict(color='orange')),
-                   secondary_y=False)
-    fig1.add_trace(go.Scatter(x=results['시간'], y=results['DC 총 소비전력 (kW)'], name="DC 총 소비전력", line=dict(color='blue')),
-                   secondary_y=True)
-    fig1.update_layout(title_text="DC 소비전력은 전력 가격에 '반응'하여 변동합니다",
-                       legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1))
-    fig1.update_yaxes(title_text="<b>가격(원/kWh)</b>", secondary_y=False)
-    fig1.update_yaxes(title_text="<b>전력(kW)</b>", secondary_y=True)
-    st.plotly_chart(fig1, use_container_width=True)
+    st.plotly_chart(plot_load_vs_price_plotly(results), use_container_width=True)
 
     st.subheader("📈 에너지 흐름 및 누적 비용")
-    fig2 = make_subplots(specs=[[{"secondary_y": True}]])
-    fig2.add_trace(go.Bar(x=results['시간'], y=results['그리드 전력 (kW)'], name="그리드 전력 (구매/판매)", marker_color='lightgreen'),
-                   secondary_y=False)
-    fig2.add_trace(
-        go.Scatter(x=results['시간'], y=results['ESS 충전량 (kWh)'], name="ESS 충전량(SoC)", line=dict(color='purple')),
-        secondary_y=False)
-    fig2.add_trace(go.Scatter(x=results['시간'], y=results['누적 비용 (원)'], name="누적 비용", line=dict(color='red', width=3)),
-                   secondary_y=True)
-    fig2.update_layout(title_text="ESS 운영 및 그리드 상호작용을 통한 비용 최적화",
-                       legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1))
-    fig2.update_yaxes(title_text="<b>전력(kW/kWh)</b>", secondary_y=False,
-                      range=[-params['max_power_kw'] * 1.5, params['max_process_power'] * 2])
-    fig2.update_yaxes(title_text="<b>누적 비용(원)</b>", secondary_y=True)
-    st.plotly_chart(fig2, use_container_width=True)
+    st.plotly_chart(plot_energy_flow_plotly(results, params['max_power_kw'], params['max_process_power']),
+                    use_container_width=True)
 
     with st.expander("📄 시간별 상세 데이터 로그 보기"):
-        st.dataframe(results)
+        # 행동 라벨 열은 상세 로그를 볼 때만 코드에서 복원
+        detail = results.copy()
+        detail['에이전트 행동'] = pd.Categorical.from_codes(action_codes, categories=ACTION_LABELS)
+        st.dataframe(detail)
 
     st.subheader("📈 전략적 수요반응 참여 분석")
     cost, incentive, reduction_kwh = analyze_incentive_vs_cost(results)